@@ -1,28 +1,36 @@
 from fastapi import FastAPI, HTTPException, Depends, Header, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.exceptions import RequestValidationError
+from fastapi.exception_handlers import request_validation_exception_handler
 from fastapi.responses import JSONResponse
-from pydantic import BaseModel, HttpUrl, ValidationError
+from pydantic import BaseModel, HttpUrl
 from supabase import create_client, Client
+from postgrest.exceptions import APIError
 import httpx
 from google import genai
 from google.genai import types
-import json
+import orjson
 import os
 import logging
 import sys
 import traceback
 import random
 import asyncio
-from datetime import datetime
+import time
+import uuid
+import hashlib
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
 from playwright.async_api import async_playwright, TimeoutError as PlaywrightTimeout
 from bs4 import BeautifulSoup
 from curl_cffi import requests as curl_requests
 from fake_useragent import UserAgent
 import cloudscraper
 
-# Configure logging - DEBUG level for maximum verbosity
+# Configure logging - set LOG_LEVEL=DEBUG for maximum verbosity
 logging.basicConfig(
-    level=logging.DEBUG,
+    level=os.getenv("LOG_LEVEL", "INFO").upper(),
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
     handlers=[
         logging.StreamHandler(sys.stdout)
@@ -32,12 +40,26 @@ logger = logging.getLogger(__name__)
 
 # Log all environment variables (safely)
 logger.debug("=== STARTUP CONFIGURATION ===")
-logger.debug(f"SUPABASE_URL set: {bool(os.getenv('SUPABASE_URL'))}")
-logger.debug(f"SUPABASE_SERVICE_KEY set: {bool(os.getenv('SUPABASE_SERVICE_KEY'))}")
-logger.debug(f"GEMINI_API_KEY set: {bool(os.getenv('GEMINI_API_KEY'))}")
-logger.debug(f"AGENT_SECRET set: {bool(os.getenv('AGENT_SECRET'))}")
+logger.debug("SUPABASE_URL set: %s", bool(os.getenv('SUPABASE_URL')))
+logger.debug("SUPABASE_SERVICE_KEY set: %s", bool(os.getenv('SUPABASE_SERVICE_KEY')))
+logger.debug("GEMINI_API_KEY set: %s", bool(os.getenv('GEMINI_API_KEY')))
+logger.debug("AGENT_SECRET set: %s", bool(os.getenv('AGENT_SECRET')))
 
-app = FastAPI(title="ScholarMap Agent", version="1.0.0")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared HTTP client so connections, TLS sessions and DNS lookups are reused across ingests
+    app.state.http = httpx.AsyncClient(
+        timeout=20.0,
+        follow_redirects=True,
+        http2=True,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+    logger.debug("Shared HTTP client created")
+    yield
+    await app.state.http.aclose()
+    logger.debug("Shared HTTP client closed")
+
+app = FastAPI(title="ScholarMap Agent", version="1.0.0", lifespan=lifespan)
 
 # Custom exception handler to log all errors
 @app.exception_handler(Exception)
@@ -53,20 +75,28 @@ async def global_exception_handler(request: Request, exc: Exception):
         content={"detail": str(exc), "type": type(exc).__name__}
     )
 
-# Log all requests
-@app.middleware("http")
+# Log request validation errors, then return FastAPI's standard 422 response
+@app.exception_handler(RequestValidationError)
+async def validation_exception_handler(request: Request, exc: RequestValidationError):
+    logger.error(f"Request validation error on {request.url.path}: {exc.errors()}")
+    return await request_validation_exception_handler(request, exc)
+
+DEBUG_BODY = os.getenv("DEBUG_BODY") == "1"
+
+# Log all requests (debug only)
 async def log_requests(request: Request, call_next):
-    logger.debug(f"=== INCOMING REQUEST ===")
-    logger.debug(f"Method: {request.method}")
-    logger.debug(f"URL: {request.url}")
-    logger.debug(f"Path: {request.url.path}")
-    logger.debug(f"Headers: {dict(request.headers)}")
+    logger.debug("=== INCOMING REQUEST ===")
+    logger.debug("Method: %s", request.method)
+    logger.debug("URL: %s", request.url)
+    logger.debug("Path: %s", request.url.path)
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Headers: %s", dict(request.headers))
     
-    # Try to read body for POST requests
-    if request.method == "POST":
+    # Buffering the body defeats streaming, so only do it when explicitly asked for
+    if request.method == "POST" and DEBUG_BODY:
         try:
             body = await request.body()
-            logger.debug(f"Raw body: {body.decode('utf-8', errors='replace')}")
+            logger.debug("Raw body: %s", body.decode('utf-8', errors='replace'))
             # Important: we need to re-set the body since we consumed it
             async def receive():
                 return {"type": "http.request", "body": body}
@@ -76,11 +106,15 @@ async def log_requests(request: Request, call_next):
     
     response = await call_next(request)
     
-    logger.debug(f"=== RESPONSE ===")
-    logger.debug(f"Status code: {response.status_code}")
+    logger.debug("=== RESPONSE ===")
+    logger.debug("Status code: %s", response.status_code)
     
     return response
 
+# The middleware adds a hop to every request, so skip it entirely unless debugging
+if logger.isEnabledFor(logging.DEBUG):
+    app.middleware("http")(log_requests)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=[
@@ -99,6 +133,10 @@ SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
 AGENT_SECRET = os.getenv("AGENT_SECRET")
 
+# Per-worker caps on concurrent page fetches and Gemini calls, to stay inside provider rate limits
+FETCH_SEM = asyncio.Semaphore(int(os.getenv("FETCH_CONCURRENCY", 20)))
+LLM_SEM = asyncio.Semaphore(int(os.getenv("LLM_CONCURRENCY", 8)))
+
 # Initialize Gemini client
 logger.debug("Initializing Gemini client...")
 try:
@@ -108,17 +146,29 @@ except Exception as e:
     logger.error(f"Failed to initialize Gemini client: {e}")
     gemini_client = None
 
+# Initialize Supabase client once; its connection pool is shared by every request
+logger.debug("Initializing Supabase client...")
+try:
+    supabase_client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
+    logger.debug("Supabase client initialized successfully")
+except Exception as e:
+    logger.error(f"Failed to initialize Supabase client: {e}")
+    supabase_client = None
+
 def get_supabase() -> Client:
-    logger.debug("Creating Supabase client...")
-    client = create_client(SUPABASE_URL, SUPABASE_SERVICE_KEY)
-    logger.debug("Supabase client created")
-    return client
+    if not supabase_client:
+        raise Exception("Supabase client not initialized")
+    return supabase_client
+
+async def run_query(query):
+    """Execute a blocking supabase-py query in a worker thread so the event loop stays free."""
+    return await asyncio.to_thread(query.execute)
 
 def verify_token(authorization: str = Header(None)):
-    logger.debug(f"=== TOKEN VERIFICATION ===")
-    logger.debug(f"Authorization header received: {authorization is not None}")
-    logger.debug(f"Authorization header value (first 20 chars): {authorization[:20] if authorization else 'None'}...")
-    logger.debug(f"Expected token starts with: Bearer {AGENT_SECRET[:10] if AGENT_SECRET else 'NOT_SET'}...")
+    logger.debug("=== TOKEN VERIFICATION ===")
+    logger.debug("Authorization header received: %s", authorization is not None)
+    logger.debug("Authorization header value (first 20 chars): %s...", authorization[:20] if authorization else 'None')
+    logger.debug("Expected token starts with: Bearer %s...", AGENT_SECRET[:10] if AGENT_SECRET else 'NOT_SET')
     
     if not authorization:
         logger.error("No authorization header provided")
@@ -127,14 +177,14 @@ def verify_token(authorization: str = Header(None)):
     expected = f"Bearer {AGENT_SECRET}"
     if authorization != expected:
         logger.error(f"Token mismatch!")
-        logger.debug(f"Received length: {len(authorization)}, Expected length: {len(expected)}")
+        logger.debug("Received length: %d, Expected length: %d", len(authorization), len(expected))
         raise HTTPException(status_code=401, detail="Unauthorized - token mismatch")
     
     logger.debug("Token verified successfully")
 
 class IngestRequest(BaseModel):
     url: HttpUrl
-    program_id: str | None = None
+    program_id: uuid.UUID | None = None
 
 class IngestResponse(BaseModel):
     success: bool
@@ -265,6 +315,16 @@ def sanitize_deadline(deadline: dict) -> dict | None:
         logger.warning(f"Failed to sanitize deadline: {e}")
         return None
 
+RAW_SUMMARY_MAX_BYTES = 10000
+
+def truncated_json(data, max_bytes: int, option: int | None = None) -> str:
+    """Serialize to JSON and cut to max_bytes without splitting a multi-byte UTF-8 character."""
+    encoded = orjson.dumps(data, option=option)
+    if len(encoded) <= max_bytes:
+        return encoded.decode('utf-8')
+    # 'ignore' only drops a trailing partial sequence left by the cut
+    return encoded[:max_bytes].decode('utf-8', 'ignore')
+
 # ==================== ULTRA-RESILIENT WEB SCRAPER ====================
 # 6-Layer fallback system to bypass ANY bot detection
 # Layer 1: curl_cffi (TLS fingerprint impersonation - mimics Chrome exactly)
@@ -338,8 +398,77 @@ def get_browser_headers() -> dict:
     }
 
 
+def record_validators(validators: dict | None, headers):
+    """Copy the page's ETag/Last-Modified into validators so the next fetch can be conditional."""
+    if validators is not None:
+        validators["etag"] = headers.get("etag")
+        validators["last_modified"] = headers.get("last-modified")
+
+
+# ==================== CONDITIONAL CHECK ====================
+async def is_page_unchanged(url: str, client: httpx.AsyncClient, etag: str | None, last_modified: str | None) -> bool:
+    """
+    Ask the server whether the page changed since the last ingest (If-None-Match / If-Modified-Since).
+    Only a 304 counts as unchanged; anything else falls through to the normal fetch layers.
+    """
+    headers = get_browser_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    
+    try:
+        # The body is never read: a 304 has none, and any other status is refetched by the layers
+        async with client.stream("GET", str(url), headers=headers) as response:
+            logger.debug("  Conditional GET status: %s", response.status_code)
+            return response.status_code == 304
+    except Exception as e:
+        logger.warning(f"  Conditional GET failed: {e}")
+        return False
+
+
 # ==================== LAYER 1: curl_cffi (TLS Fingerprint Impersonation) ====================
-async def fetch_with_curl_cffi(url: str) -> str | None:
+# Upper bound on raw HTML read per page (layers 1 and 2); cleaned text is cut to 50k chars anyway
+MAX_HTML_BYTES = 1_000_000
+
+def get_with_curl_cffi(url: str, impersonate: str):
+    """
+    Blocking streamed GET that stops reading at MAX_HTML_BYTES.
+    Returns (response, decoded body); the body is None for non-200 responses, which are not read.
+    """
+    response = curl_requests.get(
+        str(url),
+        impersonate=impersonate,
+        timeout=25,
+        allow_redirects=True,
+        stream=True,
+        headers={
+            "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
+            "Accept-Language": "en-US,en;q=0.9",
+            "Accept-Encoding": "gzip, deflate, br",
+        }
+    )
+    try:
+        if response.status_code != 200:
+            return response, None
+        
+        buf = bytearray()
+        for chunk in response.iter_content(chunk_size=8192):
+            buf.extend(chunk)
+            if len(buf) >= MAX_HTML_BYTES:
+                logger.debug("  Truncated body at %d bytes", len(buf))
+                break
+    finally:
+        response.close()
+    
+    content_type = response.headers.get("content-type") or ""
+    charset = content_type.split("charset=")[-1].split(";")[0].strip(' "\'') if "charset=" in content_type else "utf-8"
+    try:
+        return response, buf.decode(charset, errors="replace")
+    except LookupError:
+        return response, buf.decode("utf-8", errors="replace")
+
+async def fetch_with_curl_cffi(url: str, validators: dict | None = None) -> str | None:
     """
     Layer 1: curl_cffi with TLS fingerprint impersonation.
     Mimics Chrome's exact JA3/TLS fingerprint - bypasses most basic detection.
@@ -348,23 +477,12 @@ async def fetch_with_curl_cffi(url: str) -> str | None:
     
     for attempt, impersonate in enumerate(random.sample(CHROME_VERSIONS, min(3, len(CHROME_VERSIONS)))):
         try:
-            logger.debug(f"  Attempt {attempt + 1} with impersonate={impersonate}")
+            logger.debug("  Attempt %d with impersonate=%s", attempt + 1, impersonate)
             
             # curl_cffi is synchronous, run in executor
             loop = asyncio.get_event_loop()
-            response = await loop.run_in_executor(
-                None,
-                lambda: curl_requests.get(
-                    str(url),
-                    impersonate=impersonate,
-                    timeout=25,
-                    allow_redirects=True,
-                    headers={
-                        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8",
-                        "Accept-Language": "en-US,en;q=0.9",
-                        "Accept-Encoding": "gzip, deflate, br",
-                    }
-                )
+            response, content = await loop.run_in_executor(
+                None, get_with_curl_cffi, url, impersonate
             )
             
             if response.status_code in [403, 429, 503, 520, 521, 522, 523, 524]:
@@ -373,9 +491,9 @@ async def fetch_with_curl_cffi(url: str) -> str | None:
                 continue
             
             if response.status_code == 200:
-                content = response.text
                 if len(content) > 500 and "blocked" not in content.lower()[:1000]:
                     logger.info(f"  [Layer 1] SUCCESS - Got {len(content)} chars")
+                    record_validators(validators, response.headers)
                     return content
             
             logger.warning(f"  curl_cffi status {response.status_code}, content too short or blocked")
@@ -389,10 +507,12 @@ async def fetch_with_curl_cffi(url: str) -> str | None:
 
 
 # ==================== LAYER 2: httpx with Browser Headers ====================
-async def fetch_with_httpx(url: str, max_retries: int = 2) -> str | None:
+async def fetch_with_httpx(url: str, client: httpx.AsyncClient, max_retries: int = 2,
+                           validators: dict | None = None) -> str | None:
     """
     Layer 2: httpx with full browser headers and HTTP/2.
     Fast and works for sites without aggressive protection.
+    Uses the shared app-level client so connections are kept alive between calls.
     """
     logger.info(f"[Layer 2] httpx with browser headers: {url}")
     
@@ -400,26 +520,28 @@ async def fetch_with_httpx(url: str, max_retries: int = 2) -> str | None:
         headers = get_browser_headers()
         
         try:
-            async with httpx.AsyncClient(
-                timeout=20.0,
-                follow_redirects=True,
-                http2=True,
-            ) as client:
-                if attempt > 0:
-                    await asyncio.sleep(random.uniform(1.0, 2.0))
-                
-                response = await client.get(str(url), headers=headers)
-                
+            if attempt > 0:
+                await asyncio.sleep(random.uniform(1.0, 2.0))
+            
+            # Stream the body so oversized pages are cut off instead of fully buffered
+            async with client.stream("GET", str(url), headers=headers) as response:
                 if response.status_code in [403, 429, 503, 520, 521, 522, 523, 524]:
                     logger.warning(f"  httpx blocked with {response.status_code}")
                     continue
                 
                 if response.status_code == 200:
-                    content = response.text
+                    buf = bytearray()
+                    async for chunk in response.aiter_bytes(8192):
+                        buf.extend(chunk)
+                        if len(buf) >= MAX_HTML_BYTES:
+                            logger.debug("  Truncated body at %d bytes", len(buf))
+                            break
+                    content = buf.decode(response.encoding or "utf-8", errors="replace")
                     if len(content) > 500:
                         logger.info(f"  [Layer 2] SUCCESS - Got {len(content)} chars")
+                        record_validators(validators, response.headers)
                         return content
-                
+            
         except Exception as e:
             logger.warning(f"  httpx attempt {attempt + 1} failed: {e}")
     
@@ -774,7 +896,7 @@ async def fetch_with_playwright_challenge(url: str) -> str | None:
             page = await context.new_page()
             
             # First navigation
-            logger.debug(f"  First navigation to {url}")
+            logger.debug("  First navigation to %s", url)
             await page.goto(url, wait_until='domcontentloaded', timeout=30000)
             
             # Wait for any challenge to complete
@@ -820,22 +942,34 @@ async def fetch_with_playwright_challenge(url: str) -> str | None:
 
 
 # ==================== MAIN FETCH ORCHESTRATOR ====================
-async def fetch_page_content(url: str) -> str:
+async def fetch_page_content(url: str, client: httpx.AsyncClient, validators: dict | None = None) -> str | None:
     """
     Ultra-resilient content fetcher with 6-layer fallback system.
     Tries increasingly sophisticated methods until one succeeds.
+    
+    validators holds the ETag/Last-Modified seen on the previous ingest. When the server
+    confirms the page is unchanged, returns None without fetching it. Otherwise it is
+    updated in place with the new validators (layers 1 and 2 only).
     """
     logger.info(f"="*60)
     logger.info(f"FETCHING: {url}")
     logger.info(f"="*60)
     
+    if validators and (validators.get("etag") or validators.get("last_modified")):
+        if await is_page_unchanged(url, client, validators.get("etag"), validators.get("last_modified")):
+            logger.info("  [Conditional] Page not modified - skipping fetch")
+            return None
+    
+    if validators is not None:
+        validators["etag"] = validators["last_modified"] = None
+    
     # Layer 1: curl_cffi (TLS fingerprint - fastest)
-    content = await fetch_with_curl_cffi(url)
+    content = await fetch_with_curl_cffi(url, validators)
     if content:
         return clean_html_content(content)
     
     # Layer 2: httpx (fast HTTP client)
-    content = await fetch_with_httpx(url)
+    content = await fetch_with_httpx(url, client, validators=validators)
     if content:
         return clean_html_content(content)
     
@@ -868,16 +1002,39 @@ def clean_html_content(content: str) -> str:
     try:
         soup = BeautifulSoup(content, 'lxml')
         
+        # Keep structured data before scripts are stripped: JSON-LD, plus the inline app state
+        # (e.g. __NEXT_DATA__) that client-rendered pages keep their actual content in
+        structured = [
+            script.get_text(strip=True)
+            for script in soup.find_all('script', type=['application/ld+json', 'application/json'])
+            if script.get_text(strip=True)
+        ]
+        # Read as a plain string now: the decompose loop below destroys the meta tag itself
+        meta_tag = soup.find('meta', attrs={'name': 'description'})
+        meta_description = meta_tag.get('content') if meta_tag else None
+        
         # Remove unwanted elements
-        for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'noscript', 'iframe', 'svg']):
+        for element in soup(['script', 'style', 'nav', 'footer', 'header', 'aside', 'noscript', 'iframe', 'svg',
+                             'button', 'template', 'link', 'meta']):
             element.decompose()
         
-        # Get text
-        text = soup.get_text(separator='\n', strip=True)
+        # Prefer the main content region when the page marks one up, else every top-level article
+        main = soup.find('main') or soup.find(attrs={'role': 'main'})
+        regions = [main] if main else [
+            article for article in soup.find_all('article') if not article.find_parent('article')
+        ]
+        text = '\n'.join(region.get_text(separator='\n', strip=True) for region in regions)
+        if len(text) < 500:
+            text = soup.get_text(separator='\n', strip=True)
         
-        # If text is too short, return original HTML (might have useful structured data)
+        # If text is too short, send the script data instead; without any, keep the raw markup
         if len(text) < 500:
-            return content[:50000]
+            if structured:
+                if meta_description:
+                    structured.insert(0, meta_description)
+                text = '\n'.join(structured + [text])
+            else:
+                text = content
         
         return text[:50000]
         
@@ -885,63 +1042,163 @@ def clean_html_content(content: str) -> str:
         logger.warning(f"HTML cleaning failed: {e}")
         return content[:50000]
 
-def extract_with_gemini(content: str) -> dict:
+# Built once: the static prompt goes first as its own part so Gemini can reuse the shared prefix
+GEMINI_MODEL = "gemini-2.5-flash"
+EXTRACTION_PROMPT_PREFIX = f"{EXTRACTION_PROMPT}\n\nWebpage content:\n"
+EXTRACTION_CONFIG = types.GenerateContentConfig(
+    response_mime_type="application/json"
+)
+
+async def extract_with_gemini(content: str) -> dict:
     logger.debug("Starting Gemini extraction...")
-    logger.debug(f"Content length for extraction: {len(content)}")
+    logger.debug("Content length for extraction: %d", len(content))
     
     if not gemini_client:
         raise Exception("Gemini client not initialized")
     
-    response = gemini_client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=f"{EXTRACTION_PROMPT}\n\nWebpage content:\n{content}",
-        config=types.GenerateContentConfig(
-            response_mime_type="application/json"
-        )
+    response = await gemini_client.aio.models.generate_content(
+        model=GEMINI_MODEL,
+        contents=[EXTRACTION_PROMPT_PREFIX, content],
+        config=EXTRACTION_CONFIG
     )
-    logger.debug(f"Gemini response received, text length: {len(response.text)}")
-    result = json.loads(response.text)
-    logger.debug(f"JSON parsed successfully, keys: {result.keys()}")
+    logger.debug("Gemini response received, text length: %d", len(response.text))
+    result = orjson.loads(response.text)
+    logger.debug("JSON parsed successfully, keys: %s", result.keys())
     return result
 
-@app.get("/health")
-async def health():
-    logger.debug("Health check requested")
-    return {"status": "healthy", "timestamp": datetime.utcnow().isoformat()}
+# ==================== EXTRACTION CACHE ====================
+# Extractions are keyed by sha256(model + prompt, url, page content), so an unchanged page never hits
+# Gemini twice, while a prompt or model change invalidates every entry. Entries expire after
+# EXTRACTION_CACHE_TTL so a bad extraction is eventually redone by /recheck.
+# A small in-process LRU serves hot keys; the extraction_cache table shares results across workers.
+EXTRACTION_CACHE_SIZE = 1024
+EXTRACTION_CACHE_TTL = timedelta(days=7)
+EXTRACTION_VERSION = hashlib.sha256(f"{GEMINI_MODEL}\0{EXTRACTION_PROMPT_PREFIX}".encode()).hexdigest()
+extraction_cache: OrderedDict[str, tuple[datetime, dict]] = OrderedDict()
 
-@app.post("/ingest", response_model=IngestResponse)
-async def ingest(request: Request, authorization: str = Header(None)):
-    logger.debug("=== INGEST ENDPOINT CALLED ===")
+def extraction_cache_key(url: str, content: str) -> str:
+    return hashlib.sha256(f"{EXTRACTION_VERSION}\0{url}\0{content}".encode()).hexdigest()
+
+def remember_extraction(key: str, extracted: dict, created_at: datetime):
+    extraction_cache[key] = (created_at + EXTRACTION_CACHE_TTL, extracted)
+    extraction_cache.move_to_end(key)
+    if len(extraction_cache) > EXTRACTION_CACHE_SIZE:
+        extraction_cache.popitem(last=False)
+
+async def get_cached_extraction(supabase: Client, key: str) -> dict | None:
+    """Look up a previous, unexpired extraction in memory, then in the extraction_cache table."""
+    now = datetime.now(timezone.utc)
+    entry = extraction_cache.get(key)
+    if entry:
+        if entry[0] > now:
+            extraction_cache.move_to_end(key)
+            logger.debug("Extraction cache hit (memory): %s", key[:12])
+            return entry[1]
+        del extraction_cache[key]
+    
+    try:
+        result = await run_query(
+            supabase.table("extraction_cache")
+            .select("extracted, created_at")
+            .eq("content_hash", key)
+            .gte("created_at", (now - EXTRACTION_CACHE_TTL).isoformat())
+            .limit(1)
+        )
+    except Exception as e:
+        logger.warning(f"Extraction cache lookup failed: {e}")
+        return None
     
-    # Verify token first
-    verify_token(authorization)
+    if not result.data:
+        return None
     
-    # Parse body manually to get better error messages
+    logger.debug("Extraction cache hit (database): %s", key[:12])
+    row = result.data[0]
+    remember_extraction(key, row["extracted"], datetime.fromisoformat(row["created_at"]))
+    return row["extracted"]
+
+async def store_cached_extraction(supabase: Client, key: str, extracted: dict):
+    now = datetime.now(timezone.utc)
+    remember_extraction(key, extracted, now)
     try:
-        body = await request.body()
-        logger.debug(f"Request body: {body.decode('utf-8')}")
-        body_json = json.loads(body)
-        logger.debug(f"Parsed JSON: {body_json}")
-    except json.JSONDecodeError as e:
-        logger.error(f"JSON decode error: {e}")
-        raise HTTPException(status_code=400, detail=f"Invalid JSON: {e}")
+        # created_at is set explicitly so re-extracting an expired key restarts its TTL
+        await run_query(
+            supabase.table("extraction_cache").upsert(
+                {"content_hash": key, "extracted": extracted, "created_at": now.isoformat()}
+            )
+        )
+    except Exception as e:
+        logger.warning(f"Extraction cache store failed: {e}")
+
+# ==================== URL METADATA ====================
+# url -> last ingest's program_id, confidence and HTTP validators, so an unchanged page can
+# short-circuit /ingest. Entries expire so deleted or re-pointed programs are picked up again;
+# on a miss the latest sources row for the URL is used, which is shared across workers.
+URL_META_TTL_SECONDS = 6 * 3600
+URL_META_SIZE = 1024
+url_meta: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+
+def remember_url_meta(url: str, meta: dict):
+    url_meta[url] = (time.monotonic() + URL_META_TTL_SECONDS, meta)
+    url_meta.move_to_end(url)
+    if len(url_meta) > URL_META_SIZE:
+        url_meta.popitem(last=False)
+
+async def get_url_meta(supabase: Client, url: str) -> dict | None:
+    entry = url_meta.get(url)
+    if entry:
+        if entry[0] > time.monotonic():
+            url_meta.move_to_end(url)
+            return entry[1]
+        del url_meta[url]
     
-    # Validate with Pydantic
     try:
-        ingest_request = IngestRequest(**body_json)
-        logger.debug(f"Pydantic validation passed. URL: {ingest_request.url}")
-    except ValidationError as e:
-        logger.error(f"Pydantic validation error: {e}")
-        raise HTTPException(status_code=400, detail=f"Validation error: {e.errors()}")
+        result = await run_query(
+            supabase.table("sources")
+            .select("program_id, confidence_score, etag, last_modified, retrieved_at, extraction_version")
+            .eq("url", url)
+            .order("retrieved_at", desc=True)
+            .limit(1)
+        )
+    except Exception as e:
+        logger.warning(f"URL metadata lookup failed: {e}")
+        return None
     
-    supabase = get_supabase()
-    issues = []
+    if not result.data:
+        url_meta.pop(url, None)
+        return None
     
-    # Fetch page
+    row = result.data[0]
+    meta = {
+        "program_id": row["program_id"],
+        "confidence": 0.5 if row["confidence_score"] is None else float(row["confidence_score"]),
+        "etag": row.get("etag"),
+        "last_modified": row.get("last_modified"),
+        "retrieved_at": row.get("retrieved_at"),
+        "extraction_version": row.get("extraction_version"),
+    }
+    remember_url_meta(url, meta)
+    return meta
+
+def is_extraction_current(meta: dict) -> bool:
+    """True if the last extraction used the current prompt/model and is younger than the cache TTL."""
+    if meta.get("extraction_version") != EXTRACTION_VERSION or not meta.get("retrieved_at"):
+        return False
+    retrieved_at = datetime.fromisoformat(meta["retrieved_at"])
+    return datetime.now(timezone.utc) - retrieved_at < EXTRACTION_CACHE_TTL
+
+@app.get("/health")
+async def health():
+    logger.debug("Health check requested")
+    return {"status": "healthy", "timestamp": datetime.now(timezone.utc).isoformat()}
+
+LOW_CONFIDENCE_ISSUE = "Low confidence extraction - manual review recommended"
+
+async def fetch_for_ingest(url: str, client: httpx.AsyncClient, validators: dict) -> str | None:
+    """fetch_page_content under the fetch semaphore, with failures mapped to HTTP 400."""
     try:
-        logger.debug(f"Fetching URL: {ingest_request.url}")
-        content = await fetch_page_content(str(ingest_request.url))
-        logger.debug(f"Page fetched, content length: {len(content)}")
+        logger.debug("Fetching URL: %s", url)
+        async with FETCH_SEM:
+            return await fetch_page_content(url, client, validators)
     except httpx.HTTPStatusError as e:
         logger.error(f"HTTP error fetching URL: {e}")
         raise HTTPException(status_code=400, detail=f"Failed to fetch URL: HTTP {e.response.status_code}")
@@ -949,16 +1206,70 @@ async def ingest(request: Request, authorization: str = Header(None)):
         logger.error(f"Error fetching URL: {e}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=400, detail=f"Failed to fetch URL: {e}")
+
+async def _do_ingest(url: str, program_id: str | None, client: httpx.AsyncClient) -> IngestResponse:
+    """Fetch, extract and store one program page. Shared by /ingest and /recheck."""
+    supabase = get_supabase()
+    issues = []
+    # One timestamp for every row written by this ingest
+    now = datetime.now(timezone.utc).isoformat()
     
-    # Extract with Gemini
+    # Only send validators from an earlier ingest of this same program, and only while that
+    # ingest's extraction is still current; otherwise a 304 would keep a stale extraction forever
+    meta = await get_url_meta(supabase, url)
+    if meta and (program_id not in (None, meta["program_id"]) or not is_extraction_current(meta)):
+        meta = None
+    validators = {
+        "etag": meta["etag"] if meta else None,
+        "last_modified": meta["last_modified"] if meta else None,
+    }
+    
+    # Fetch page
+    content = await fetch_for_ingest(url, client, validators)
+    
+    # Unchanged since the last ingest: just mark the program as verified
+    if content is None:
+        try:
+            result = await run_query(
+                supabase.table("programs").update({"last_verified_at": now}).eq("id", meta["program_id"])
+            )
+        except Exception as e:
+            logger.error(f"Database error: {e}")
+            logger.error(traceback.format_exc())
+            raise HTTPException(status_code=500, detail=f"Database error: {e}")
+        
+        if result.data:
+            remember_url_meta(url, meta)
+            logger.debug("=== INGEST COMPLETE (not modified) ===")
+            issues = [LOW_CONFIDENCE_ISSUE] if meta["confidence"] < 0.5 else []
+            return IngestResponse(success=True, program_id=meta["program_id"], confidence=meta["confidence"], issues=issues)
+        
+        # The cached program is gone, so its validators are meaningless: do a full ingest instead
+        logger.warning(f"Cached program {meta['program_id']} for {url} no longer exists, refetching")
+        url_meta.pop(url, None)
+        validators = {"etag": None, "last_modified": None}
+        content = await fetch_for_ingest(url, client, validators)
+    
+    logger.debug("Page fetched, content length: %d", len(content))
+    
+    # Extract with Gemini, unless this exact page was already extracted
+    cache_key = extraction_cache_key(url, content)
     try:
-        logger.debug("Starting Gemini extraction...")
-        extracted = extract_with_gemini(content)
-        logger.debug(f"Extraction complete. Keys: {list(extracted.keys())}")
-        logger.debug(f"Extracted name: {extracted.get('name')}")
-        logger.debug(f"Extracted provider: {extracted.get('provider')}")
-        logger.debug(f"Extracted level: {extracted.get('level')}")
-        logger.debug(f"Full extraction result: {json.dumps(extracted, indent=2)[:2000]}")
+        extracted = await get_cached_extraction(supabase, cache_key)
+        if extracted is None:
+            logger.debug("Starting Gemini extraction...")
+            async with LLM_SEM:
+                extracted = await extract_with_gemini(content)
+            await store_cached_extraction(supabase, cache_key, extracted)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Extraction complete. Keys: %s", list(extracted.keys()))
+            logger.debug("Extracted name: %s", extracted.get('name'))
+            logger.debug("Extracted provider: %s", extracted.get('provider'))
+            logger.debug("Extracted level: %s", extracted.get('level'))
+            logger.debug(
+                "Full extraction result: %s",
+                truncated_json(extracted, 2000, option=orjson.OPT_INDENT_2)
+            )
     except Exception as e:
         logger.error(f"Extraction failed: {e}")
         logger.error(traceback.format_exc())
@@ -968,7 +1279,7 @@ async def ingest(request: Request, authorization: str = Header(None)):
     issues.extend(extracted.get("issues", []))
     
     if confidence < 0.5:
-        issues.append("Low confidence extraction - manual review recommended")
+        issues.append(LOW_CONFIDENCE_ISSUE)
     
     program_data = {
         "name": extracted.get("name") or "Unknown Program",
@@ -978,112 +1289,134 @@ async def ingest(request: Request, authorization: str = Header(None)):
         "countries_eligible": extracted.get("countries_eligible") or [],
         "countries_of_study": extracted.get("countries_of_study") or [],
         "fields": extracted.get("fields") or [],
-        "official_url": str(ingest_request.url),
+        "official_url": url,
         "description": extracted.get("description"),
         "who_wins": extracted.get("who_wins"),
         "rejection_reasons": extracted.get("rejection_reasons"),
         "status": "active",
-        "last_verified_at": datetime.utcnow().isoformat()
+        "last_verified_at": now
     }
     
-    logger.debug(f"Program data prepared: {program_data['name']}")
+    logger.debug("Program data prepared: %s", program_data['name'])
+    
+    # Build child rows up front so they can be sent in a single write.
+    # Gemini often repeats itself, so rows with the same natural key are only kept once.
+    rules = []
+    seen = set()
+    for rule in extracted.get("eligibility_rules", []):
+        sanitized = sanitize_eligibility_rule(rule)
+        if sanitized:
+            key = (sanitized["rule_type"], sanitized["operator"],
+                   orjson.dumps(sanitized["value"], option=orjson.OPT_SORT_KEYS))
+            if key not in seen:
+                seen.add(key)
+                rules.append(sanitized)
+    
+    requirements = []
+    seen = set()
+    for req in extracted.get("requirements", []):
+        sanitized = sanitize_requirement(req)
+        if sanitized:
+            key = (sanitized["type"], sanitized["description"])
+            if key not in seen:
+                seen.add(key)
+                requirements.append(sanitized)
+    
+    deadlines = []
+    seen = set()
+    for deadline in extracted.get("deadlines", []):
+        sanitized = sanitize_deadline(deadline)
+        if sanitized and sanitized.get("deadline_date"):
+            key = (sanitized["cycle"], sanitized["stage"], sanitized["deadline_date"])
+            if key not in seen:
+                seen.add(key)
+                deadlines.append(sanitized)
+    
+    reviews = [
+        {
+            "issue_type": "suspicious" if confidence < 0.5 else "missing_data",
+            "note": issue,
+            "severity": "high" if confidence < 0.5 else "low"
+        }
+        for issue in issues
+    ]
+    
+    # Everything is written by the ingest_program function in one round trip and one transaction
+    payload = {
+        "program_id": program_id,
+        "program": program_data,
+        "eligibility_rules": rules,
+        "requirements": requirements,
+        "deadlines": deadlines,
+        "source": {
+            "url": url,
+            "retrieved_at": now,
+            "agent_model": GEMINI_MODEL,
+            "raw_summary": truncated_json(extracted, RAW_SUMMARY_MAX_BYTES),
+            "confidence_score": confidence,
+            "etag": validators["etag"],
+            "last_modified": validators["last_modified"],
+            "extraction_version": EXTRACTION_VERSION
+        },
+        "reviews": reviews,
+    }
     
     try:
-        if ingest_request.program_id:
-            logger.debug(f"Updating existing program: {ingest_request.program_id}")
-            result = supabase.table("programs").update(program_data).eq("id", ingest_request.program_id).execute()
-            program_id = ingest_request.program_id
-            supabase.table("eligibility_rules").delete().eq("program_id", program_id).execute()
-            supabase.table("requirements").delete().eq("program_id", program_id).execute()
-            supabase.table("deadlines").delete().eq("program_id", program_id).execute()
-        else:
-            logger.debug("Inserting new program...")
-            result = supabase.table("programs").insert(program_data).execute()
-            program_id = result.data[0]["id"]
-            logger.debug(f"New program created with ID: {program_id}")
-        
-        # Insert eligibility rules (with sanitization)
-        for rule in extracted.get("eligibility_rules", []):
-            sanitized = sanitize_eligibility_rule(rule)
-            if sanitized:
-                logger.debug(f"Inserting eligibility rule: {sanitized['rule_type']} {sanitized['operator']}")
-                supabase.table("eligibility_rules").insert({
-                    "program_id": program_id,
-                    "rule_type": sanitized["rule_type"],
-                    "operator": sanitized["operator"],
-                    "value": sanitized["value"],
-                    "confidence": sanitized["confidence"],
-                    "source_snippet": sanitized["source_snippet"]
-                }).execute()
-        
-        # Insert requirements (with sanitization)
-        for req in extracted.get("requirements", []):
-            sanitized = sanitize_requirement(req)
-            if sanitized:
-                logger.debug(f"Inserting requirement: {sanitized['type']}")
-                supabase.table("requirements").insert({
-                    "program_id": program_id,
-                    "type": sanitized["type"],
-                    "description": sanitized["description"],
-                    "mandatory": sanitized["mandatory"]
-                }).execute()
-        
-        # Insert deadlines (with sanitization)
-        for deadline in extracted.get("deadlines", []):
-            sanitized = sanitize_deadline(deadline)
-            if sanitized and sanitized.get("deadline_date"):
-                logger.debug(f"Inserting deadline: {sanitized['stage']}")
-                supabase.table("deadlines").insert({
-                    "program_id": program_id,
-                    "cycle": sanitized["cycle"],
-                    "deadline_date": sanitized["deadline_date"],
-                    "stage": sanitized["stage"]
-                }).execute()
-        
-        # Insert source
-        logger.debug("Inserting source record...")
-        supabase.table("sources").insert({
+        logger.debug(
+            "Writing program via ingest_program: %d rules, %d requirements, %d deadlines, %d reviews",
+            len(rules), len(requirements), len(deadlines), len(reviews)
+        )
+        result = await run_query(supabase.rpc("ingest_program", {"payload": payload}))
+        program_id = result.data
+        logger.debug("Program written with ID: %s", program_id)
+        remember_url_meta(url, {
             "program_id": program_id,
-            "url": str(ingest_request.url),
-            "agent_model": "gemini-2.5-flash",
-            "raw_summary": json.dumps(extracted)[:10000],
-            "confidence_score": confidence
-        }).execute()
-        
-        # Insert reviews if any issues
-        if issues:
-            for issue in issues:
-                logger.debug(f"Inserting review: {issue}")
-                supabase.table("agent_reviews").insert({
-                    "program_id": program_id,
-                    "issue_type": "suspicious" if confidence < 0.5 else "missing_data",
-                    "note": issue,
-                    "severity": "high" if confidence < 0.5 else "low"
-                }).execute()
+            "confidence": confidence,
+            **validators,
+            "retrieved_at": now,
+            "extraction_version": EXTRACTION_VERSION,
+        })
         
+    except APIError as e:
+        # ingest_program raises these explicitly; surface them as client errors
+        if e.code == "23505":
+            logger.error(f"URL conflict: {e.message}")
+            raise HTTPException(status_code=409, detail=e.message)
+        if e.code == "P0002":
+            logger.error(f"Program not found: {e.message}")
+            raise HTTPException(status_code=404, detail=e.message)
+        logger.error(f"Database error: {e}")
+        logger.error(traceback.format_exc())
+        raise HTTPException(status_code=500, detail=f"Database error: {e}")
     except Exception as e:
         logger.error(f"Database error: {e}")
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Database error: {e}")
     
-    logger.debug(f"=== INGEST COMPLETE ===")
-    logger.debug(f"Program ID: {program_id}, Confidence: {confidence}, Issues: {issues}")
+    logger.debug("=== INGEST COMPLETE ===")
+    logger.debug("Program ID: %s, Confidence: %s, Issues: %s", program_id, confidence, issues)
     
     return IngestResponse(success=True, program_id=program_id, confidence=confidence, issues=issues)
 
-@app.post("/recheck")
-async def recheck(program_id: str, authorization: str = Header(None)):
-    logger.debug(f"Recheck requested for program: {program_id}")
-    verify_token(authorization)
+# Token is checked as a dependency so an unauthenticated caller gets a 401 before body validation
+@app.post("/ingest", response_model=IngestResponse, dependencies=[Depends(verify_token)])
+async def ingest(ingest_request: IngestRequest, request: Request):
+    logger.debug("=== INGEST ENDPOINT CALLED ===")
+    logger.debug("URL: %s", ingest_request.url)
+    
+    program_id = str(ingest_request.program_id) if ingest_request.program_id else None
+    return await _do_ingest(str(ingest_request.url), program_id, request.app.state.http)
+
+@app.post("/recheck", response_model=IngestResponse, dependencies=[Depends(verify_token)])
+async def recheck(program_id: uuid.UUID, request: Request):
+    logger.debug("Recheck requested for program: %s", program_id)
     
     supabase = get_supabase()
-    program = supabase.table("programs").select("official_url").eq("id", program_id).single().execute()
+    program = await run_query(supabase.table("programs").select("official_url").eq("id", str(program_id)).limit(1))
     if not program.data:
         raise HTTPException(status_code=404, detail="Program not found")
     
-    # Create a mock request for the ingest function
-    from fastapi import Request as FastAPIRequest
-    # This is a bit hacky but works for recheck
-    return {"message": "Use /ingest endpoint directly with program_id parameter"}
+    # Re-run the ingest pipeline in-process against the program's stored URL
+    return await _do_ingest(program.data[0]["official_url"], str(program_id), request.app.state.http)
 
 logger.debug("=== APPLICATION STARTUP COMPLETE ===")
@@ -0,0 +1 @@
+# Lets tests import the app package (`from app.main import ...`) when pytest runs from backend/
@@ -0,0 +1,31 @@
+from app.main import clean_html_content
+
+
+SPA_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+  <meta name="description" content="Fully funded masters scholarship for African students.">
+  <script type="application/ld+json">{"@type": "EducationalOccupationalProgram", "name": "Example Scholarship"}</script>
+</head>
+<body>
+  <div id="__next"></div>
+  <script id="__NEXT_DATA__" type="application/json">{"props": {"pageProps": {"deadline": "2026-11-15"}}}</script>
+  <script src="/_next/static/chunks/main.js"></script>
+</body>
+</html>
+"""
+
+
+def test_client_rendered_page_sends_structured_data_not_markup():
+    text = clean_html_content(SPA_PAGE)
+
+    assert "<html" not in text
+    assert text.startswith("Fully funded masters scholarship for African students.")
+    assert '"name": "Example Scholarship"' in text
+    assert '"deadline": "2026-11-15"' in text
+
+
+def test_short_page_without_structured_data_keeps_raw_markup():
+    page = "<html><body><div id='root'></div><script src='/app.js'></script></body></html>"
+
+    assert clean_html_content(page) == page
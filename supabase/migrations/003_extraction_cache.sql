@@ -0,0 +1,12 @@
+-- Extraction cache: Gemini results keyed by sha256(url + page content)
+create table public.extraction_cache (
+  content_hash text primary key,
+  extracted jsonb not null,
+  created_at timestamptz default now()
+);
+
+alter table public.extraction_cache enable row level security;
+
+-- Extraction cache: service role only
+create policy "Service role manages extraction cache" on public.extraction_cache
+  for all using (auth.role() = 'service_role');
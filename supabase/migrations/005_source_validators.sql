@@ -0,0 +1,76 @@
+-- HTTP validators from the last fetch, so re-ingesting an unchanged page can use a conditional GET
+alter table public.sources add column etag text;
+alter table public.sources add column last_modified text;
+
+create index idx_sources_url_retrieved on public.sources(url, retrieved_at desc);
+
+-- ingest_program: also store the validators (source.etag, source.last_modified)
+create or replace function public.ingest_program(payload jsonb)
+returns uuid as $$
+declare
+  v_program_id uuid := nullif(payload->>'program_id', '')::uuid;
+  p public.programs := jsonb_populate_record(null::public.programs, payload->'program');
+begin
+  if v_program_id is not null then
+    update public.programs set
+      name = p.name,
+      provider = p.provider,
+      level = p.level,
+      funding_type = p.funding_type,
+      countries_eligible = p.countries_eligible,
+      countries_of_study = p.countries_of_study,
+      fields = p.fields,
+      official_url = p.official_url,
+      description = p.description,
+      who_wins = p.who_wins,
+      rejection_reasons = p.rejection_reasons,
+      status = p.status,
+      last_verified_at = p.last_verified_at
+    where id = v_program_id;
+
+    if not found then
+      raise exception 'Program % not found', v_program_id;
+    end if;
+
+    delete from public.eligibility_rules where program_id = v_program_id;
+    delete from public.requirements where program_id = v_program_id;
+    delete from public.deadlines where program_id = v_program_id;
+  else
+    insert into public.programs (
+      name, provider, level, funding_type, countries_eligible, countries_of_study, fields,
+      official_url, description, who_wins, rejection_reasons, status, last_verified_at
+    ) values (
+      p.name, p.provider, p.level, p.funding_type, p.countries_eligible, p.countries_of_study, p.fields,
+      p.official_url, p.description, p.who_wins, p.rejection_reasons, p.status, p.last_verified_at
+    )
+    returning id into v_program_id;
+  end if;
+
+  insert into public.eligibility_rules (program_id, rule_type, operator, value, confidence, source_snippet)
+  select v_program_id, r.rule_type, r.operator, r.value, r.confidence, r.source_snippet
+  from jsonb_populate_recordset(null::public.eligibility_rules, coalesce(payload->'eligibility_rules', '[]')) r;
+
+  insert into public.requirements (program_id, type, description, mandatory)
+  select v_program_id, r.type, r.description, r.mandatory
+  from jsonb_populate_recordset(null::public.requirements, coalesce(payload->'requirements', '[]')) r;
+
+  insert into public.deadlines (program_id, cycle, deadline_date, stage)
+  select v_program_id, d.cycle, d.deadline_date, d.stage
+  from jsonb_populate_recordset(null::public.deadlines, coalesce(payload->'deadlines', '[]')) d;
+
+  insert into public.sources (program_id, url, retrieved_at, agent_model, raw_summary, confidence_score, etag, last_modified)
+  select v_program_id, s.url, s.retrieved_at, s.agent_model, s.raw_summary, s.confidence_score, s.etag, s.last_modified
+  from jsonb_populate_record(null::public.sources, payload->'source') s
+  where payload->'source' is not null;
+
+  insert into public.agent_reviews (program_id, issue_type, note, severity)
+  select v_program_id, r.issue_type, r.note, r.severity
+  from jsonb_populate_recordset(null::public.agent_reviews, coalesce(payload->'reviews', '[]')) r;
+
+  return v_program_id;
+end;
+$$ language plpgsql;
+
+-- Only the agent (service role) may call it
+revoke execute on function public.ingest_program(jsonb) from public, anon, authenticated;
+grant execute on function public.ingest_program(jsonb) to service_role;
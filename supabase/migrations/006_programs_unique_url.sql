@@ -0,0 +1,126 @@
+-- One program per official URL, so ingest can upsert instead of branching on insert/update
+
+-- Collapse existing duplicates first, keeping the most recently verified program for each URL.
+-- Source history and reviews move onto the kept program; the duplicates' extracted rules,
+-- requirements and deadlines are superseded by the kept program's and go via on delete cascade.
+create temporary table program_duplicates as
+select id as duplicate_id, keep_id
+from (
+  select id, first_value(id) over (
+    partition by official_url
+    order by coalesce(last_verified_at, created_at) desc nulls last, id desc
+  ) as keep_id
+  from public.programs
+) ranked
+where id <> keep_id;
+
+update public.sources s set program_id = d.keep_id
+from program_duplicates d
+where s.program_id = d.duplicate_id;
+
+update public.agent_reviews r set program_id = d.keep_id
+from program_duplicates d
+where r.program_id = d.duplicate_id;
+
+delete from public.programs p
+using program_duplicates d
+where p.id = d.duplicate_id;
+
+drop table program_duplicates;
+
+alter table public.programs add constraint programs_official_url_key unique (official_url);
+
+-- ingest_program: upsert on official_url when no program_id is given
+create or replace function public.ingest_program(payload jsonb)
+returns uuid as $$
+declare
+  v_program_id uuid := nullif(payload->>'program_id', '')::uuid;
+  p public.programs := jsonb_populate_record(null::public.programs, payload->'program');
+begin
+  if v_program_id is not null then
+    -- Re-pointing a program at a URL another program owns would break the unique constraint
+    if exists (
+      select 1 from public.programs where official_url = p.official_url and id <> v_program_id
+    ) then
+      raise exception 'Another program already uses official_url %', p.official_url
+        using errcode = 'unique_violation';
+    end if;
+
+    update public.programs set
+      name = p.name,
+      provider = p.provider,
+      level = p.level,
+      funding_type = p.funding_type,
+      countries_eligible = p.countries_eligible,
+      countries_of_study = p.countries_of_study,
+      fields = p.fields,
+      official_url = p.official_url,
+      description = p.description,
+      who_wins = p.who_wins,
+      rejection_reasons = p.rejection_reasons,
+      status = p.status,
+      last_verified_at = p.last_verified_at
+    where id = v_program_id;
+
+    if not found then
+      raise exception 'Program % not found', v_program_id
+        using errcode = 'no_data_found';
+    end if;
+  else
+    -- One program per official URL: re-ingesting a known URL updates it in place
+    insert into public.programs (
+      name, provider, level, funding_type, countries_eligible, countries_of_study, fields,
+      official_url, description, who_wins, rejection_reasons, status, last_verified_at
+    ) values (
+      p.name, p.provider, p.level, p.funding_type, p.countries_eligible, p.countries_of_study, p.fields,
+      p.official_url, p.description, p.who_wins, p.rejection_reasons, p.status, p.last_verified_at
+    )
+    on conflict (official_url) do update set
+      name = excluded.name,
+      provider = excluded.provider,
+      level = excluded.level,
+      funding_type = excluded.funding_type,
+      countries_eligible = excluded.countries_eligible,
+      countries_of_study = excluded.countries_of_study,
+      fields = excluded.fields,
+      description = excluded.description,
+      who_wins = excluded.who_wins,
+      rejection_reasons = excluded.rejection_reasons,
+      status = excluded.status,
+      last_verified_at = excluded.last_verified_at
+    returning id into v_program_id;
+  end if;
+
+  -- Replace child rows (a no-op for a freshly inserted program)
+  delete from public.eligibility_rules where program_id = v_program_id;
+  delete from public.requirements where program_id = v_program_id;
+  delete from public.deadlines where program_id = v_program_id;
+
+  insert into public.eligibility_rules (program_id, rule_type, operator, value, confidence, source_snippet)
+  select v_program_id, r.rule_type, r.operator, r.value, r.confidence, r.source_snippet
+  from jsonb_populate_recordset(null::public.eligibility_rules, coalesce(payload->'eligibility_rules', '[]')) r;
+
+  insert into public.requirements (program_id, type, description, mandatory)
+  select v_program_id, r.type, r.description, r.mandatory
+  from jsonb_populate_recordset(null::public.requirements, coalesce(payload->'requirements', '[]')) r;
+
+  insert into public.deadlines (program_id, cycle, deadline_date, stage)
+  select v_program_id, d.cycle, d.deadline_date, d.stage
+  from jsonb_populate_recordset(null::public.deadlines, coalesce(payload->'deadlines', '[]')) d;
+
+  insert into public.sources (program_id, url, retrieved_at, agent_model, raw_summary, confidence_score, etag, last_modified)
+  select v_program_id, s.url, s.retrieved_at, s.agent_model, s.raw_summary, s.confidence_score, s.etag, s.last_modified
+  from jsonb_populate_record(null::public.sources, payload->'source') s
+  where payload->'source' is not null;
+
+  insert into public.agent_reviews (program_id, issue_type, note, severity)
+  select v_program_id, r.issue_type, r.note, r.severity
+  from jsonb_populate_recordset(null::public.agent_reviews, coalesce(payload->'reviews', '[]')) r;
+
+  return v_program_id;
+end;
+$$ language plpgsql;
+
+-- Only the agent (service role) may call it
+revoke execute on function public.ingest_program(jsonb) from public, anon, authenticated;
+grant execute on function public.ingest_program(jsonb) to service_role;